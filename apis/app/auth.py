@@ -1,92 +1,218 @@
-from datetime import datetime, timedelta
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
 from typing import Optional, Union
 
+import jwt
+import orjson
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
 from loguru import logger
-from passlib.context import CryptContext
 
 from app.config import config
 from app.database import PostgresClient
 from app.dependencies import get_postgres_client
-from app.models import TokenData, UserInDB, User, UserRole
+from app.models import ROLE_MAP, TokenData, UserInDB, User, UserRole
+from app.passwords import hash_password, hash_password_async, needs_rehash, verify_password_async
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_JWT_SECRET = config.jwt.secret_key
+_JWT_ALG = config.jwt.algorithm
+_JWT_ALG_LIST = [config.jwt.algorithm]
+_JWT_EXPIRES = config.jwt.access_token_expires
+_JWT_EXPIRES_SECONDS = int(_JWT_EXPIRES.total_seconds())
+
+
+class _OrjsonEncoder(json.JSONEncoder):
+    # PyJWT only ever calls encode(); orjson emits compact output, matching
+    # the separators PyJWT asks for.
+    def encode(self, o) -> str:
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        return orjson.dumps(o, option=option).decode()
+
+
+# A fresh exception per raise: a shared instance would carry the previous
+# request's traceback and frame locals, and concurrent requests would race
+# on it.
+def _credentials_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def _inactive_error() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+
+
+def _admin_error() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
+# Short-lived in-process cache of user records so that authenticated requests
+# don't hit the database on every call. Cache operations never await, so they
+# are atomic with respect to the event loop and need no extra locking.
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# Recent password verification results, keyed by username and a peppered
+# HMAC of the candidate password, so repeated logins skip the hashing work.
+# The pepper is generated per process and never leaves memory.
+_PASSWORD_PEPPER = secrets.token_bytes(32)
+_verify_cache: TTLCache = TTLCache(maxsize=1024, ttl=300)
 
+_DUMMY_HASH = hash_password("dummy")
+
+# Decoded claims of recently seen bearer tokens, keyed by a digest of the
+# token, so replayed tokens skip signature verification. Entries are only
+# honoured while the token itself is still unexpired.
+_token_cache: TTLCache = TTLCache(maxsize=50_000, ttl=60)
+
+# Strong references to in-flight background writes so they aren't collected
+# before they finish.
+_background_tasks: set = set()
+
+
+def _run_in_background(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _rehash_password(db: PostgresClient, username: str, password: str) -> None:
+    # Legacy bcrypt hashes, or argon2 hashes made with older costs, are
+    # replaced with a current one while the plaintext is at hand.
+    try:
+        hashed_password = await hash_password_async(password)
+        await db.update_password_hash(username, hashed_password)
+        invalidate_user(username)
+    except Exception as e:
+        logger.warning(f"Could not upgrade password hash for {username}: {e}")
+
+
+async def _get_user_cached(db: PostgresClient, username: str) -> Optional[UserInDB]:
+    user = _user_cache.get(username)
+    if user is not None:
+        return user
 
-async def authenticate_user(db: PostgresClient, username: str, password: str) -> Optional[UserInDB]:
     user = await db.get_user(username)
-    if not user:
-        return None
-    if not verify_password(password, user.hashed_password):
+    if user is not None:
+        _user_cache[username] = user
+    return user
+
+
+def invalidate_user(username: str) -> None:
+    _user_cache.pop(username, None)
+
+
+async def _verify_password_cached(username: str, password: str, hashed_password: str) -> bool:
+    key = (username, hmac.new(_PASSWORD_PEPPER, password.encode(), hashlib.sha256).digest())
+    cached = _verify_cache.get(key)
+    # The stored hash is part of the entry so a password change invalidates it.
+    if cached is not None and cached[1] == hashed_password:
+        return cached[0]
+
+    ok = await verify_password_async(password, hashed_password)
+    _verify_cache[key] = (ok, hashed_password)
+    return ok
+
+
+async def authenticate_user(db: PostgresClient, username: str, password: str) -> Optional[UserInDB]:
+    user = await _get_user_cached(db, username)
+    # Unknown users are checked against a dummy hash so both branches cost the
+    # same hashing work and response timing doesn't reveal which names exist.
+    hashed_password = user.hashed_password if user else _DUMMY_HASH
+    ok = await _verify_password_cached(username, password, hashed_password)
+    if not user or not ok:
         return None
-    await db.update_last_login(username)
+    # last_login is written in the background so the login response isn't
+    # blocked on the UPDATE; the value becomes visible shortly after.
+    _run_in_background(db.update_last_login(username))
+    if needs_rehash(user.hashed_password):
+        _run_in_background(_rehash_password(db, username, password))
     return user
 
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + config.jwt.access_token_expires
-    to_encode.update({"exp": expire})
+    to_encode["exp"] = int(time.time()) + _JWT_EXPIRES_SECONDS
     encoded_jwt = jwt.encode(
-        to_encode, 
-        config.jwt.secret_key, 
-        algorithm=config.jwt.algorithm
+        to_encode,
+        _JWT_SECRET,
+        algorithm=_JWT_ALG,
+        json_encoder=_OrjsonEncoder
     )
     return encoded_jwt
 
 
+def _check_token_shape(token: str) -> None:
+    # Cheap structural checks so garbage tokens are rejected before paying
+    # for base64 + JSON + HMAC in jwt.decode.
+    parts = token.split(".")
+    if len(parts) != 3:
+        raise jwt.DecodeError("Not enough segments")
+    try:
+        header = orjson.loads(base64.urlsafe_b64decode(parts[0] + "=" * (-len(parts[0]) % 4)))
+    except ValueError:
+        raise jwt.DecodeError("Invalid header")
+    if not isinstance(header, dict) or header.get("alg") != _JWT_ALG:
+        raise jwt.InvalidAlgorithmError("Unexpected algorithm")
+
+
+def _decode_token(token: str) -> tuple:
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    claims = _token_cache.get(key)
+    if claims is not None and claims[2] > time.time():
+        return claims
+
+    _check_token_shape(token)
+
+    payload = jwt.decode(token, _JWT_SECRET, algorithms=_JWT_ALG_LIST)
+    claims = (payload.get("sub"), payload.get("role"), payload.get("exp"))
+    if claims[2] is not None:
+        _token_cache[key] = claims
+    return claims
+
+
+# Auth failures are logged at DEBUG with deferred formatting: under a flood
+# of bad tokens, per-request warnings would become a CPU and disk sink.
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: PostgresClient = Depends(get_postgres_client)
 ) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
     try:
-        payload = jwt.decode(
-            token, 
-            config.jwt.secret_key, 
-            algorithms=[config.jwt.algorithm]
-        )
-        username: str = payload.get("sub")
-        role: str = payload.get("role")
+        username, role, _ = _decode_token(token)
         
+        role = ROLE_MAP.get(role)
         if username is None or role is None:
-            logger.warning("Missing username or role in token")
-            raise credentials_exception
+            logger.debug("Missing username or unknown role in token")
+            raise _credentials_error()
             
-        token_data = TokenData(username=username, role=UserRole(role))
+        token_data = TokenData.model_construct(username=username, role=role)
         
-    except JWTError as e:
-        logger.error(f"JWT error: {e}")
-        raise credentials_exception
+    except jwt.PyJWTError as e:
+        logger.debug("JWT error: {}", e)
+        raise _credentials_error()
     
-    user = await db.get_user(token_data.username)
+    user = await _get_user_cached(db, token_data.username)
     
     if user is None:
-        logger.warning(f"User not found: {token_data.username}")
-        raise credentials_exception
+        logger.debug("User not found: {}", token_data.username)
+        raise _credentials_error()
         
     if not user.is_active:
-        logger.warning(f"Inactive user: {token_data.username}")
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Inactive user"
-        )
+        logger.debug("Inactive user: {}", token_data.username)
+        raise _inactive_error()
     
-    return User(
+    # Fields were already validated when the row was loaded into UserInDB.
+    return User.model_construct(
         username=user.username,
         email=user.email,
         full_name=user.full_name,
@@ -97,18 +223,11 @@ async def get_current_user(
 
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
-    if not current_user.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Inactive user"
-        )
+    # get_current_user already rejects inactive users with a 403.
     return current_user
 
 
-def require_admin(current_user: User = Depends(get_current_user)) -> User:
+async def require_admin(current_user: User = Depends(get_current_active_user)) -> User:
     if current_user.role != UserRole.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Admin privileges required"
-        )
+        raise _admin_error()
     return current_user
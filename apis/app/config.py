@@ -1,6 +1,7 @@
 import os
 from datetime import timedelta
-from pydantic import BaseModel
+from functools import cached_property
+from pydantic import BaseModel, ConfigDict
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -8,27 +9,47 @@ load_dotenv()
 
 
 class ClickHouseSettings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     host: str = os.getenv("CLICKHOUSE_HOST", "localhost")
     port: int = int(os.getenv("CLICKHOUSE_PORT", "9000"))
     user: str = os.getenv("CLICKHOUSE_USER", "default")
     password: str = os.getenv("CLICKHOUSE_PASSWORD", "")
     database: str = os.getenv("CLICKHOUSE_DATABASE", "default")
+    pool_size: int = int(os.getenv("CLICKHOUSE_POOL_SIZE", "10"))
+    query_cache_ttl: int = int(os.getenv("CLICKHOUSE_QUERY_CACHE_TTL", "30"))
+    compression: str = os.getenv("CLICKHOUSE_COMPRESSION", "lz4")
+    # Per-query caps so one broad read can't monopolise the server; 0 leaves
+    # the server default.
+    max_threads: int = int(os.getenv("CLICKHOUSE_MAX_THREADS", "4"))
+    max_execution_time: int = int(os.getenv("CLICKHOUSE_MAX_EXECUTION_TIME", "30"))
 
 
 class PostgresSettings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     host: str = os.getenv("POSTGRES_HOST", "localhost")
     port: int = int(os.getenv("POSTGRES_PORT", "5432"))
     user: str = os.getenv("POSTGRES_USER", "postgres")
     password: str = os.getenv("POSTGRES_PASSWORD", "postgres")
     database: str = os.getenv("POSTGRES_DATABASE", "iot_monitoring")
+    pool_min_size: int = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2"))
+    pool_max_size: int = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "20"))
+    statement_cache_size: int = int(os.getenv("POSTGRES_STATEMENT_CACHE_SIZE", "100"))
 
 
 class JWTSettings(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     secret_key: str = os.getenv("JWT_SECRET_KEY", "your-secret-key-for-jwt-please-change-in-production")
     algorithm: str = os.getenv("JWT_ALGORITHM", "HS256")
     access_token_expire_minutes: int = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+    # argon2id costs: iterations, memory in KiB, lanes.
+    argon2_time_cost: int = int(os.getenv("ARGON2_TIME_COST", "3"))
+    argon2_memory_cost: int = int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+    argon2_parallelism: int = int(os.getenv("ARGON2_PARALLELISM", "4"))
     
-    @property
+    @cached_property
     def access_token_expires(self) -> timedelta:
         return timedelta(minutes=self.access_token_expire_minutes)
 
@@ -36,6 +57,9 @@ class JWTSettings(BaseModel):
 class Settings(BaseSettings):
     app_name: str = "IoT Monitoring API Service"
     debug: bool = os.getenv("DEBUG", "False").lower() == "true"
+    # Each worker process has its own pools and in-memory caches, and a
+    # user's cache entry is only invalidated in the worker that changed it.
+    workers: int = int(os.getenv("WORKERS", "1"))
     clickhouse: ClickHouseSettings = ClickHouseSettings()
     postgres: PostgresSettings = PostgresSettings()
     jwt: JWTSettings = JWTSettings()
@@ -1,31 +1,375 @@
-from datetime import datetime
-from typing import List, Optional, Dict, Any, Union
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
+import asyncpg
+from cachetools import TTLCache
 from clickhouse_driver import Client, defines
 from loguru import logger
-from passlib.context import CryptContext
-import asyncpg
+from pydantic import TypeAdapter
 
 from app.config import config
-from app.models import SensorData, SensorStats, UserInDB, UserRole, Device, User
+from app.models import ROLE_MAP, SensorStats, UserInDB, UserRole, Device, User
+from app.passwords import hash_password_async
+
+
+# Hot-path statements are kept as constants so the query text is identical on
+# every call and asyncpg's per-connection prepared statement cache always hits.
+_GET_USER_SQL = """
+    SELECT 
+        username, 
+        email, 
+        full_name, 
+        hashed_password, 
+        role, 
+        created_at,
+        last_login,
+        is_active
+    FROM users
+    WHERE username = $1
+"""
+
+_INSERT_USER_SQL = """
+    INSERT INTO users 
+    (username, email, full_name, hashed_password, role, created_at, last_login, is_active)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+    ON CONFLICT (username) DO NOTHING
+    RETURNING username
+"""
+
+_UPDATE_LAST_LOGIN_SQL = """
+    UPDATE users 
+    SET last_login = $1 
+    WHERE username = $2
+"""
+
+_UPDATE_PASSWORD_HASH_SQL = """
+    UPDATE users 
+    SET hashed_password = $1 
+    WHERE username = $2
+"""
+
+_INSERT_DEVICE_SQL = """
+    INSERT INTO devices 
+    (device_id, name, location, description, created_at, is_active)
+    VALUES ($1, $2, $3, $4, $5, TRUE)
+    ON CONFLICT (device_id) DO NOTHING
+    RETURNING device_id, name, location, description, created_at, is_active
+"""
+
+_GET_DEVICE_SQL = """
+    SELECT device_id, name, location, description, created_at, is_active
+    FROM devices
+    WHERE device_id = $1
+"""
+
+_GET_DEVICES_SQL = """
+    SELECT device_id, name, location, description, created_at, is_active
+    FROM devices
+    ORDER BY created_at DESC
+    LIMIT $1
+"""
+
+_IMPORT_DEVICE_SQL = """
+    INSERT INTO devices 
+    (device_id, name, location, description, created_at, is_active)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (device_id) DO NOTHING
+"""
+
+_DEVICE_UPDATE_COLUMNS = ("name", "location", "description", "is_active")
+
+_DELETE_DEVICE_SQL = """
+    DELETE FROM devices 
+    WHERE device_id = $1
+    RETURNING device_id
+"""
+
+
+# Updates only set the columns the client sent; one statement per set of
+# columns, so each stays a stable prepared statement.
+@lru_cache(maxsize=None)
+def _update_device_query(columns: Tuple[str, ...]) -> str:
+    assignments = ", ".join(f"{column} = ${i}" for i, column in enumerate(columns, start=2))
+    return f"""
+    UPDATE devices 
+    SET {assignments}
+    WHERE device_id = $1
+    RETURNING device_id, name, location, description, created_at, is_active
+"""
+
+
+# The sensor queries only vary by which optional filters are set, so each
+# variant is rendered once and reused. Values travel as typed server-side
+# parameters ({name:Type}) next to the query, never spliced into its text.
+_FILTER_COLUMNS = ("device_id", "sensor_type", "location")
+
+
+# Smaller blocks than the server default keep the rows in flight per read
+# bounded while results are streamed out.
+_STREAM_SETTINGS = {"max_block_size": 8192}
+
+# Request-path reads give up after max_execution_time instead of holding a
+# pooled connection and server resources indefinitely. The NDJSON stream is
+# exempt: its duration is bounded by how fast the client reads.
+_TIMEOUT_SETTINGS = (
+    {"max_execution_time": config.clickhouse.max_execution_time}
+    if config.clickhouse.max_execution_time > 0
+    else {}
+)
+_FETCH_SETTINGS = {**_STREAM_SETTINGS, **_TIMEOUT_SETTINGS}
+
+# Raw-row reads can touch every part when no filter is set; capping their
+# threads leaves cores for concurrent dashboard queries. Aggregations keep the
+# server default, they mostly read the much smaller hourly rollup.
+_SCAN_SETTINGS = (
+    {"max_threads": config.clickhouse.max_threads}
+    if config.clickhouse.max_threads > 0
+    else {}
+)
+
+# sensor_data is sorted by (device_id, sensor_type, timestamp): once both
+# leading columns are filtered, ORDER BY timestamp DESC follows the sort key
+# and the server reads granules backwards, stopping at the LIMIT instead of
+# sorting the whole range. Time ranges are pruned by the toYYYYMM(timestamp)
+# partition minmax index, so no extra predicate is needed for that.
+_TIME_ORDERED_SETTINGS = {"optimize_read_in_order": 1, **_SCAN_SETTINGS}
+
+# Dashboards poll the same latest, stats and metadata queries over and over;
+# the server answers repeats from its query cache for a few seconds (a TTL of
+# 0 turns this off). The query text per filter combination is fixed, so
+# identical requests share a cache entry.
+_QUERY_CACHE_SETTINGS = (
+    {"use_query_cache": 1, "query_cache_ttl": config.clickhouse.query_cache_ttl}
+    if config.clickhouse.query_cache_ttl > 0
+    else {}
+)
+
+# GROUP BY device_id, sensor_type is a prefix of the sensor_data sort key, so
+# raw-range stats finalise each group as the key changes instead of holding
+# one hash table for the whole range.
+_AGGREGATION_SETTINGS = {
+    "optimize_aggregation_in_order": 1,
+    "optimize_read_in_order": 1,
+    **_QUERY_CACHE_SETTINGS
+}
+
+
+# Stats and device rows are turned into dicts and validated as one list by
+# pydantic-core: a single call into Rust per result is cheaper than building
+# each model in Python, model_construct included. Raw sensor rows skip models
+# altogether: the column types already match SensorData and the endpoints
+# encode the dicts straight to JSON.
+_SENSOR_DATA_COLUMNS = ("device_id", "sensor_type", "value", "unit", "timestamp", "location", "metadata")
+_SENSOR_STATS_COLUMNS = ("device_id", "sensor_type", "min_value", "max_value", "avg_value", "unit")
+_DEVICE_COLUMNS = ("device_id", "name", "location", "description", "created_at", "is_active")
+
+_SENSOR_STATS_LIST = TypeAdapter(List[SensorStats])
+_DEVICE_LIST = TypeAdapter(List[Device])
+
+
+def _sensor_data_from_rows(rows: Iterable[tuple]) -> List[Dict[str, Any]]:
+    return [dict(zip(_SENSOR_DATA_COLUMNS, row)) for row in rows]
+
+
+def _sensor_stats_from_rows(
+    rows: Iterable[tuple], from_timestamp: datetime, to_timestamp: datetime
+) -> List[SensorStats]:
+    return _SENSOR_STATS_LIST.validate_python([
+        {
+            **dict(zip(_SENSOR_STATS_COLUMNS, row)),
+            "from_timestamp": from_timestamp,
+            "to_timestamp": to_timestamp
+        }
+        for row in rows
+    ])
+
+
+def _devices_from_rows(rows: Iterable[Sequence]) -> List[Device]:
+    return _DEVICE_LIST.validate_python(
+        [dict(zip(_DEVICE_COLUMNS, row)) for row in rows]
+    )
+
+
+def _add_filter_params(params: dict, *values: Optional[str]) -> tuple:
+    mask = tuple(bool(value) for value in values)
+    for column, value in zip(_FILTER_COLUMNS, values):
+        if value:
+            params[column] = value
+    return mask
+
+
+def _filter_sql(mask: tuple) -> str:
+    return "".join(
+        f" AND {column} = {{{column}:String}}"
+        for column, enabled in zip(_FILTER_COLUMNS, mask)
+        if enabled
+    )
+
+
+@lru_cache(maxsize=None)
+def _latest_query(mask: tuple) -> str:
+    return f"""
+        SELECT 
+            device_id, 
+            sensor_type, 
+            value, 
+            unit, 
+            timestamp, 
+            location, 
+            metadata
+        FROM 
+            sensor_data
+        WHERE 
+            1=1{_filter_sql(mask)}
+        ORDER BY timestamp DESC
+        LIMIT {{limit:UInt32}}
+    """
+
+
+@lru_cache(maxsize=None)
+def _historical_query(mask: tuple) -> str:
+    return f"""
+        SELECT 
+            device_id, 
+            sensor_type, 
+            value, 
+            unit, 
+            timestamp, 
+            location, 
+            metadata
+        FROM 
+            sensor_data
+        WHERE 
+            timestamp BETWEEN {{from_ts:DateTime}} AND {{to_ts:DateTime}}{_filter_sql(mask)}
+        ORDER BY timestamp DESC
+        LIMIT {{limit:UInt32}}
+    """
+
+
+@lru_cache(maxsize=None)
+def _stats_query(mask: tuple, use_rollup: bool) -> str:
+    filters = _filter_sql(mask)
+    if not use_rollup:
+        return f"""
+            SELECT 
+                device_id, 
+                sensor_type, 
+                min(value) as min_value,
+                max(value) as max_value,
+                avg(value) as avg_value,
+                any(unit) as unit
+            FROM 
+                sensor_data
+            WHERE 
+                timestamp BETWEEN {{from_ts:DateTime}} AND {{to_ts:DateTime}}{filters}
+            GROUP BY device_id, sensor_type
+            ORDER BY device_id, sensor_type
+        """
+
+    # Whole hours come from the pre-aggregated hourly rollup; only the
+    # partial hours at either edge of the range are read from raw rows.
+    return f"""
+        SELECT 
+            device_id, 
+            sensor_type, 
+            minMerge(min_value) as min_value,
+            maxMerge(max_value) as max_value,
+            avgMerge(avg_value) as avg_value,
+            anyMerge(unit) as unit
+        FROM (
+            SELECT 
+                device_id, 
+                sensor_type, 
+                min_value, 
+                max_value, 
+                avg_value, 
+                unit
+            FROM 
+                sensor_stats_hourly
+            WHERE 
+                bucket >= {{full_from:DateTime}} AND bucket < {{full_to:DateTime}}{filters}
+            UNION ALL
+            SELECT 
+                device_id, 
+                sensor_type, 
+                minState(value), 
+                maxState(value), 
+                avgState(value), 
+                anyState(unit)
+            FROM 
+                sensor_data
+            WHERE 
+                (
+                    (timestamp >= {{from_ts:DateTime}} AND timestamp < {{full_from:DateTime}})
+                    OR (timestamp >= {{full_to:DateTime}} AND timestamp <= {{to_ts:DateTime}})
+                ){filters}
+            GROUP BY device_id, sensor_type
+        )
+        GROUP BY device_id, sensor_type
+        ORDER BY device_id, sensor_type
+    """
 
+# Distinct devices / sensor types / locations change on human timescales, so
+# the metadata endpoints serve them from memory; misses read the small
+# sensor_meta dimension table rather than scanning sensor_data.
+_metadata_cache: TTLCache = TTLCache(maxsize=16, ttl=60)
+_metadata_pending: Dict[str, asyncio.Future] = {}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_ONE_SECOND = timedelta(seconds=1)
+
+
+def _as_utc(ts: datetime) -> datetime:
+    # Hour boundaries have to match toStartOfHour on the server. Offsets
+    # that aren't whole hours (+05:30) would otherwise put them on :30, so
+    # aware values are rounded in UTC; naive ones are already server time.
+    return ts.astimezone(timezone.utc) if ts.tzinfo is not None else ts
+
+
+def _floor_hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(ts: datetime) -> datetime:
+    floored = _floor_hour(ts)
+    return floored if floored == ts else floored + timedelta(hours=1)
+
+
+def _whole_hours(from_ts: datetime, to_ts: datetime) -> Optional[Tuple[datetime, datetime]]:
+    # The whole server hours inside [from_ts, to_ts], or None if there
+    # isn't one. Pass values through _as_utc first.
+    full_from = _ceil_hour(from_ts)
+    full_to = _floor_hour(to_ts)
+    return (full_from, full_to) if full_from < full_to else None
 
 
 class PostgresClient:
     def __init__(self):
         self.pool = None
+        self._connect_lock = asyncio.Lock()
         logger.info("PostgreSQL client initialized")
 
     async def connect(self):
-        if not self.pool:
+        # Concurrent first requests must not each create their own pool.
+        async with self._connect_lock:
+            if self.pool:
+                return
             self.pool = await asyncpg.create_pool(
                 host=config.postgres.host,
                 port=config.postgres.port,
                 user=config.postgres.user,
                 password=config.postgres.password,
-                database=config.postgres.database
+                database=config.postgres.database,
+                min_size=config.postgres.pool_min_size,
+                max_size=config.postgres.pool_max_size,
+                # Set to 0 behind PgBouncer in transaction mode, where a
+                # statement prepared on one server connection isn't visible
+                # on the next.
+                statement_cache_size=config.postgres.statement_cache_size
             )
             logger.info(f"Connected to PostgreSQL at {config.postgres.host}:{config.postgres.port}")
             await self._ensure_tables_exist()
@@ -44,40 +388,47 @@ class PostgresClient:
                     is_active BOOLEAN NOT NULL DEFAULT TRUE
                 )
             """)
+            # Devices are keyed point lookups and in-place updates: an OLTP
+            # workload that belongs here rather than in ClickHouse.
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS devices (
+                    device_id VARCHAR(255) PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    location VARCHAR(255) NOT NULL DEFAULT '',
+                    description TEXT NOT NULL DEFAULT '',
+                    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+                    is_active BOOLEAN NOT NULL DEFAULT TRUE
+                )
+            """)
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS devices_created_at_idx ON devices (created_at DESC)"
+            )
             logger.info("PostgreSQL tables check/creation completed")
 
     async def create_user(self, user_data: dict) -> UserInDB:
         username = user_data["username"]
         
+        now = datetime.now(timezone.utc)
+        hashed_password = await hash_password_async(user_data["password"].get_secret_value())
+        
+        role = user_data.get("role", UserRole.USER.value)
+        
+        user = {
+            "username": username,
+            "email": user_data["email"],
+            "full_name": user_data.get("full_name", ""),
+            "hashed_password": hashed_password,
+            "role": role,
+            "created_at": now,
+            "last_login": None,
+            "is_active": True
+        }
+        
+        # The primary key decides whether the username is taken, in the same
+        # statement as the insert, so concurrent signups can't both succeed.
         async with self.pool.acquire() as conn:
-            exists = await conn.fetchval(
-                "SELECT EXISTS(SELECT 1 FROM users WHERE username = $1)",
-                username
-            )
-            if exists:
-                raise ValueError(f"User with username '{username}' already exists")
-            
-            now = datetime.utcnow()
-            hashed_password = pwd_context.hash(user_data["password"].get_secret_value())
-            
-            role = user_data.get("role", UserRole.USER.value)
-            
-            user = {
-                "username": username,
-                "email": user_data["email"],
-                "full_name": user_data.get("full_name", ""),
-                "hashed_password": hashed_password,
-                "role": role,
-                "created_at": now,
-                "last_login": None,
-                "is_active": True
-            }
-            
-            await conn.execute("""
-                INSERT INTO users 
-                (username, email, full_name, hashed_password, role, created_at, last_login, is_active)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-            """,
+            inserted = await conn.fetchval(
+                _INSERT_USER_SQL,
                 user["username"],
                 user["email"],
                 user["full_name"],
@@ -87,61 +438,248 @@ class PostgresClient:
                 user["last_login"],
                 user["is_active"]
             )
-            
-            return UserInDB(**user)
+        
+        if inserted is None:
+            raise ValueError(f"User with username '{username}' already exists")
+        
+        return UserInDB(**user)
     
     async def get_user(self, username: str) -> Optional[UserInDB]:
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow("""
-                SELECT 
-                    username, 
-                    email, 
-                    full_name, 
-                    hashed_password, 
-                    role, 
-                    created_at,
-                    last_login,
-                    is_active
-                FROM users
-                WHERE username = $1
-            """, username)
+            row = await conn.fetchrow(_GET_USER_SQL, username)
             
             if not row:
                 return None
                 
-            return UserInDB(
+            # Rows were validated on the way in and Postgres returns typed
+            # values, so there's nothing left to coerce.
+            return UserInDB.model_construct(
                 username=row['username'],
                 email=row['email'],
                 full_name=row['full_name'],
                 hashed_password=row['hashed_password'],
-                role=UserRole(row['role']),
+                role=ROLE_MAP[row['role']],
                 created_at=row['created_at'],
                 last_login=row['last_login'],
                 is_active=row['is_active']
             )
     
     async def update_last_login(self, username: str) -> None:
-        now = datetime.utcnow()
+        now = datetime.now(timezone.utc)
         async with self.pool.acquire() as conn:
-            await conn.execute("""
-                UPDATE users 
-                SET last_login = $1 
-                WHERE username = $2
-            """, now, username)
+            await conn.execute(_UPDATE_LAST_LOGIN_SQL, now, username)
+
+    async def update_password_hash(self, username: str, hashed_password: str) -> None:
+        async with self.pool.acquire() as conn:
+            await conn.execute(_UPDATE_PASSWORD_HASH_SQL, hashed_password, username)
+
+    async def create_device(self, device_data: dict) -> Device:
+        device_id = device_data["device_id"]
+        
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                _INSERT_DEVICE_SQL,
+                device_id,
+                device_data["name"],
+                device_data.get("location") or "",
+                device_data.get("description") or "",
+                datetime.now(timezone.utc)
+            )
+        
+        if row is None:
+            raise ValueError(f"Device with ID '{device_id}' already exists")
+        
+        return _devices_from_rows([row])[0]
+    
+    async def get_device(self, device_id: str) -> Optional[Device]:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(_GET_DEVICE_SQL, device_id)
+        
+        if row is None:
+            return None
+        
+        return _devices_from_rows([row])[0]
+    
+    async def get_all_devices(self, limit: int = 100) -> List[Device]:
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(_GET_DEVICES_SQL, limit)
+        
+        return _devices_from_rows(rows)
+    
+    async def update_device(self, device_id: str, device_data: dict) -> Optional[Device]:
+        columns = tuple(column for column in _DEVICE_UPDATE_COLUMNS if column in device_data)
+        if not columns:
+            return await self.get_device(device_id)
+        
+        # location and description are stored as '' when unset, as on create.
+        values = [
+            "" if device_data[column] is None else device_data[column]
+            for column in columns
+        ]
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(_update_device_query(columns), device_id, *values)
+        
+        if row is None:
+            return None
+        
+        return _devices_from_rows([row])[0]
+    
+    async def import_devices(self, devices: List[Device]) -> None:
+        # Devices that already exist in Postgres are left as they are.
+        async with self.pool.acquire() as conn:
+            await conn.executemany(_IMPORT_DEVICE_SQL, [
+                (
+                    device.device_id,
+                    device.name,
+                    device.location or "",
+                    device.description or "",
+                    # ClickHouse DateTime values come back naive, in UTC.
+                    device.created_at.replace(tzinfo=timezone.utc)
+                    if device.created_at.tzinfo is None else device.created_at,
+                    device.is_active
+                )
+                for device in devices
+            ])
+    
+    async def delete_device(self, device_id: str) -> bool:
+        async with self.pool.acquire() as conn:
+            deleted = await conn.fetchval(_DELETE_DEVICE_SQL, device_id)
+        
+        return deleted is not None
 
 
 class ClickHouseClient:
 
     def __init__(self):
-        self.client = Client(
+        # Each pooled Client owns one native connection, opened lazily on first
+        # use. LIFO ordering keeps recently used, already connected clients hot.
+        self._pool: asyncio.LifoQueue = asyncio.LifoQueue()
+        for _ in range(config.clickhouse.pool_size):
+            self._pool.put_nowait(self._create_client())
+        # One worker per pooled connection, separate from the loop's default
+        # executor: queries never wait behind other blocking work and every
+        # checked-out client always has a thread to run on.
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.clickhouse.pool_size, thread_name_prefix="clickhouse"
+        )
+        logger.info(
+            f"ClickHouse pool of {config.clickhouse.pool_size} connections to "
+            f"{config.clickhouse.host}:{config.clickhouse.port}"
+        )
+
+    @staticmethod
+    def _create_client() -> Client:
+        return Client(
             host=config.clickhouse.host,
             port=config.clickhouse.port,
             user=config.clickhouse.user,
             password=config.clickhouse.password,
             database=config.clickhouse.database,
-            client_revision=defines.DBMS_MIN_PROTOCOL_VERSION_WITH_QUOTA_KEY
+            # First protocol revision that carries query parameters.
+            client_revision=defines.DBMS_MIN_PROTOCOL_VERSION_WITH_PARAMETERS,
+            settings={"server_side_params": True},
+            # Result blocks are compressed on the wire; LZ4 roughly halves the
+            # bytes for wide reads at negligible CPU cost.
+            compression=config.clickhouse.compression or False
         )
-        logger.info(f"Connected to ClickHouse at {config.clickhouse.host}:{config.clickhouse.port}")
+
+    async def _execute(self, query: str, params: Optional[Union[dict, list]] = None, **kwargs) -> Any:
+        return await self._with_client(
+            lambda client: client.execute(query, params, **kwargs)
+        )
+
+    async def _fetch(
+        self,
+        query: str,
+        params: dict,
+        build: Callable[[Iterable[tuple]], List[Any]],
+        settings: Optional[dict] = None
+    ) -> List[Any]:
+        settings = {**_FETCH_SETTINGS, **settings} if settings else _FETCH_SETTINGS
+
+        # Stream blocks into the builder on the worker thread, so the raw rows
+        # are never held as one full list next to the models.
+        def run(client: Client) -> List[Any]:
+            return build(client.execute_iter(query, params, settings=settings))
+
+        return await self._with_client(run)
+
+    async def _stream(
+        self,
+        query: str,
+        params: dict,
+        build: Callable[[Iterable[tuple]], List[Any]],
+        settings: Optional[dict] = None
+    ) -> AsyncIterator[List[Any]]:
+        settings = {**_STREAM_SETTINGS, **settings} if settings else _STREAM_SETTINGS
+        client = await self._pool.get()
+        loop = asyncio.get_running_loop()
+        pending = None
+        finished = False
+        try:
+            # execute_iter connects and sends the query before returning, so
+            # it runs on a worker thread too and a failure still releases the
+            # client below. chunk_size hands back a block's worth of rows per
+            # step; the next one is only requested once the caller has
+            # consumed the previous chunk.
+            pending = loop.run_in_executor(self._executor, partial(
+                client.execute_iter,
+                query, params, settings=settings, chunk_size=settings["max_block_size"]
+            ))
+            chunks = await asyncio.shield(pending)
+            while True:
+                pending = loop.run_in_executor(self._executor, next, chunks, None)
+                chunk = await asyncio.shield(pending)
+                if chunk is None:
+                    finished = True
+                    return
+                yield build(chunk)
+        finally:
+            def release(future: Optional[asyncio.Future] = None) -> None:
+                if future is not None and not future.cancelled():
+                    future.exception()
+                # A result abandoned halfway leaves unread packets on the
+                # connection; drop it so the next query reconnects cleanly.
+                if not finished:
+                    client.disconnect()
+                self._pool.put_nowait(client)
+
+            if pending is not None and not pending.done():
+                pending.add_done_callback(release)
+            else:
+                release()
+
+    async def _with_client(self, fn: Callable[[Client], Any]) -> Any:
+        # clickhouse_driver is blocking, so queries run on a worker thread with
+        # a client checked out of the pool; concurrent requests run in parallel
+        # on separate connections without stalling the event loop.
+        client = await self._pool.get()
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(fn, client)
+        )
+        # Only hand the client back once its thread is done with it, even if
+        # the awaiting request gets cancelled in the meantime.
+        future.add_done_callback(lambda _: self._pool.put_nowait(client))
+        return await asyncio.shield(future)
+
+    async def warm_up(self) -> None:
+        # Open every pooled connection up front so the first requests after a
+        # start don't each pay the TCP + native handshake. Not fatal: clients
+        # still connect on first use if ClickHouse isn't reachable yet.
+        try:
+            await asyncio.gather(*(
+                self._with_client(lambda client: client.connection.force_connect())
+                for _ in range(config.clickhouse.pool_size)
+            ))
+        except Exception as e:
+            logger.warning(f"Could not pre-open ClickHouse connections: {e}")
+
+    async def close(self) -> None:
+        # Waiting for in-flight queries happens off the event loop, so other
+        # shutdown handlers (and the queries themselves) can still finish.
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+        while not self._pool.empty():
+            self._pool.get_nowait().disconnect()
 
     async def get_latest_sensor_data(
         self, 
@@ -149,57 +687,17 @@ class ClickHouseClient:
         sensor_type: Optional[str] = None,
         location: Optional[str] = None,
         limit: int = 100
-    ) -> List[SensorData]:
-        query = f"""
-            SELECT 
-                device_id, 
-                sensor_type, 
-                value, 
-                unit, 
-                timestamp, 
-                location, 
-                metadata
-            FROM 
-                sensor_data
-            WHERE 
-                1=1
-        """
-        
-        params = {}
-        
-        if device_id:
-            query += " AND device_id = %(device_id)s"
-            params["device_id"] = device_id
-            
-        if sensor_type:
-            query += " AND sensor_type = %(sensor_type)s"
-            params["sensor_type"] = sensor_type
-            
-        if location:
-            query += " AND location = %(location)s"
-            params["location"] = location
-            
-        query += """
-            ORDER BY timestamp DESC
-            LIMIT %(limit)s
-        """
-        params["limit"] = limit
+    ) -> List[Dict[str, Any]]:
+        params = {"limit": limit}
+        mask = _add_filter_params(params, device_id, sensor_type, location)
         
         try:
-            result = self.client.execute(query, params)
-            
-            return [
-                SensorData(
-                    device_id=row[0],
-                    sensor_type=row[1],
-                    value=row[2],
-                    unit=row[3],
-                    timestamp=row[4],
-                    location=row[5],
-                    metadata=row[6]
-                )
-                for row in result
-            ]
+            return await self._fetch(
+                _latest_query(mask),
+                params,
+                _sensor_data_from_rows,
+                {**_TIME_ORDERED_SETTINGS, **_QUERY_CACHE_SETTINGS}
+            )
         except Exception as e:
             logger.error(f"Error getting latest sensor data: {e}")
             raise
@@ -212,62 +710,75 @@ class ClickHouseClient:
         sensor_type: Optional[str] = None,
         location: Optional[str] = None,
         limit: int = 1000
-    ) -> List[SensorData]:
-        query = f"""
-            SELECT 
-                device_id, 
-                sensor_type, 
-                value, 
-                unit, 
-                timestamp, 
-                location, 
-                metadata
-            FROM 
-                sensor_data
-            WHERE 
-                timestamp BETWEEN %(from_ts)s AND %(to_ts)s
-        """
+    ) -> List[Dict[str, Any]]:
+        params = {"limit": limit}
+        mask = _add_filter_params(params, device_id, sensor_type, location)
+        query = _historical_query(mask)
+        from_timestamp = _as_utc(from_timestamp)
+        to_timestamp = _as_utc(to_timestamp)
+
+        # Sliding dashboard windows never repeat exactly, but their whole
+        # hours do: that part runs as its own query the server can answer
+        # from its query cache, the partial hours at either edge are read
+        # fresh. Pieces are read newest first until the limit is filled.
+        # timestamp is whole seconds, so BETWEEN ... - 1s is a half-open range.
+        # Windows without a whole hour, or without partial edges, stay one
+        # query: splitting them would only add round trips.
+        hours = _whole_hours(from_timestamp, to_timestamp)
+        if hours is not None and hours != (from_timestamp, to_timestamp):
+            full_from, full_to = hours
+            pieces = [
+                (full_to, to_timestamp, _TIME_ORDERED_SETTINGS),
+                (full_from, full_to - _ONE_SECOND, {**_TIME_ORDERED_SETTINGS, **_QUERY_CACHE_SETTINGS}),
+                (from_timestamp, full_from - _ONE_SECOND, _TIME_ORDERED_SETTINGS),
+            ]
+        else:
+            pieces = [(from_timestamp, to_timestamp, _TIME_ORDERED_SETTINGS)]
         
+        try:
+            data: List[Dict[str, Any]] = []
+            for from_ts, to_ts, settings in pieces:
+                if from_ts > to_ts:
+                    continue
+                data.extend(await self._fetch(
+                    query,
+                    {**params, "from_ts": from_ts, "to_ts": to_ts},
+                    _sensor_data_from_rows,
+                    settings
+                ))
+                if len(data) >= limit:
+                    break
+            return data[:limit]
+        except Exception as e:
+            logger.error(f"Error getting historical sensor data: {e}")
+            raise
+
+    async def stream_historical_data(
+        self,
+        from_timestamp: datetime,
+        to_timestamp: datetime,
+        device_id: Optional[str] = None,
+        sensor_type: Optional[str] = None,
+        location: Optional[str] = None,
+        limit: int = 1000
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
         params = {
             "from_ts": from_timestamp,
-            "to_ts": to_timestamp
+            "to_ts": to_timestamp,
+            "limit": limit
         }
-        
-        if device_id:
-            query += " AND device_id = %(device_id)s"
-            params["device_id"] = device_id
-            
-        if sensor_type:
-            query += " AND sensor_type = %(sensor_type)s"
-            params["sensor_type"] = sensor_type
-            
-        if location:
-            query += " AND location = %(location)s"
-            params["location"] = location
-            
-        query += """
-            ORDER BY timestamp DESC
-            LIMIT %(limit)s
-        """
-        params["limit"] = limit
+        mask = _add_filter_params(params, device_id, sensor_type, location)
         
         try:
-            result = self.client.execute(query, params)
-            
-            return [
-                SensorData(
-                    device_id=row[0],
-                    sensor_type=row[1],
-                    value=row[2],
-                    unit=row[3],
-                    timestamp=row[4],
-                    location=row[5],
-                    metadata=row[6]
-                )
-                for row in result
-            ]
+            # aclosing: a caller that stops early releases the connection
+            # right away instead of whenever the generator is collected.
+            async with aclosing(self._stream(
+                _historical_query(mask), params, _sensor_data_from_rows, _TIME_ORDERED_SETTINGS
+            )) as batches:
+                async for batch in batches:
+                    yield batch
         except Exception as e:
-            logger.error(f"Error getting historical sensor data: {e}")
+            logger.error(f"Error streaming historical sensor data: {e}")
             raise
 
     async def get_aggregated_stats(
@@ -278,230 +789,112 @@ class ClickHouseClient:
         sensor_type: Optional[str] = None,
         location: Optional[str] = None
     ) -> List[SensorStats]:
-        query = f"""
-            SELECT 
-                device_id, 
-                sensor_type, 
-                min(value) as min_value,
-                max(value) as max_value,
-                avg(value) as avg_value,
-                any(unit) as unit
-            FROM 
-                sensor_data
-            WHERE 
-                timestamp BETWEEN %(from_ts)s AND %(to_ts)s
-        """
-        
         params = {
-            "from_ts": from_timestamp,
-            "to_ts": to_timestamp
+            "from_ts": _as_utc(from_timestamp),
+            "to_ts": _as_utc(to_timestamp)
         }
-        
-        if device_id:
-            query += " AND device_id = %(device_id)s"
-            params["device_id"] = device_id
-            
-        if sensor_type:
-            query += " AND sensor_type = %(sensor_type)s"
-            params["sensor_type"] = sensor_type
-            
-        if location:
-            query += " AND location = %(location)s"
-            params["location"] = location
-            
-        query += """
-            GROUP BY device_id, sensor_type
-            ORDER BY device_id, sensor_type
-        """
+        mask = _add_filter_params(params, device_id, sensor_type, location)
+
+        hours = _whole_hours(params["from_ts"], params["to_ts"])
+        use_rollup = hours is not None
+
+        if use_rollup:
+            params["full_from"], params["full_to"] = hours
         
         try:
-            result = self.client.execute(query, params)
-            
-            return [
-                SensorStats(
-                    device_id=row[0],
-                    sensor_type=row[1],
-                    min_value=row[2],
-                    max_value=row[3],
-                    avg_value=row[4],
-                    unit=row[5],
-                    from_timestamp=from_timestamp,
-                    to_timestamp=to_timestamp
-                )
-                for row in result
-            ]
+            return await self._fetch(
+                _stats_query(mask, use_rollup),
+                params,
+                lambda rows: _sensor_stats_from_rows(rows, from_timestamp, to_timestamp),
+                _AGGREGATION_SETTINGS
+            )
         except Exception as e:
             logger.error(f"Error getting aggregated sensor stats: {e}")
             raise
 
+    async def _get_cached_values(self, key: str, query: str) -> List[str]:
+        values = _metadata_cache.get(key)
+        if values is not None:
+            return values
+
+        # Concurrent misses for the same key share one query instead of all
+        # hitting ClickHouse when the entry expires under dashboard load.
+        pending = _metadata_pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load_values(key, query))
+            _metadata_pending[key] = pending
+            pending.add_done_callback(lambda _: _metadata_pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _load_values(self, key: str, query: str) -> List[str]:
+        result = await self._execute(query, settings={**_TIMEOUT_SETTINGS, **_QUERY_CACHE_SETTINGS})
+        values = [row[0] for row in result]
+        _metadata_cache[key] = values
+        return values
+
     async def get_unique_devices(self) -> List[str]:
         try:
-            result = self.client.execute("SELECT DISTINCT device_id FROM sensor_data ORDER BY device_id")
-            return [row[0] for row in result]
+            return await self._get_cached_values(
+                "devices", "SELECT DISTINCT device_id FROM sensor_meta ORDER BY device_id"
+            )
         except Exception as e:
             logger.error(f"Error getting unique devices: {e}")
             raise
 
     async def get_unique_sensor_types(self) -> List[str]:
         try:
-            result = self.client.execute("SELECT DISTINCT sensor_type FROM sensor_data ORDER BY sensor_type")
-            return [row[0] for row in result]
+            return await self._get_cached_values(
+                "sensor_types", "SELECT DISTINCT sensor_type FROM sensor_meta ORDER BY sensor_type"
+            )
         except Exception as e:
             logger.error(f"Error getting unique sensor types: {e}")
             raise
 
     async def get_unique_locations(self) -> List[str]:
         try:
-            result = self.client.execute("SELECT DISTINCT location FROM sensor_data ORDER BY location")
-            return [row[0] for row in result]
+            return await self._get_cached_values(
+                "locations", "SELECT DISTINCT location FROM sensor_meta ORDER BY location"
+            )
         except Exception as e:
             logger.error(f"Error getting unique locations: {e}")
             raise
 
-    async def get_unique_sensor_ids(self) -> List[str]:
-        try:
-            result = self.client.execute("SELECT DISTINCT device_id FROM sensor_data ORDER BY device_id")
-            return [row[0] for row in result]
-        except Exception as e:
-            logger.error(f"Error getting unique sensor IDs: {e}")
-            raise
+    async def get_all_metadata(self) -> Dict[str, List[str]]:
+        # Each list keeps its own cache entry and single-flight load; misses
+        # run concurrently on separate pooled connections.
+        devices, sensor_types, locations = await asyncio.gather(
+            self.get_unique_devices(),
+            self.get_unique_sensor_types(),
+            self.get_unique_locations()
+        )
+        return {"devices": devices, "sensor_types": sensor_types, "locations": locations}
 
-    async def create_device(self, device_data: dict) -> Device:
-        device_id = device_data["device_id"]
+    async def get_unique_sensor_ids(self) -> List[str]:
+        # Sensors are identified by their device ID, so this is the same list
+        # as get_unique_devices and shares its cache entry; kept for the
+        # /metadata/sensor-ids endpoint.
+        return await self.get_unique_devices()
 
-        result = self.client.execute(
-            "SELECT count() FROM devices WHERE device_id = %(device_id)s",
-            {"device_id": device_id}
-        )
-        if result[0][0] > 0:
-            raise ValueError(f"Device with ID '{device_id}' already exists")
-        
-        now = datetime.utcnow()
-        
-        device = {
-            "device_id": device_id,
-            "name": device_data["name"],
-            "location": device_data.get("location", ""),
-            "description": device_data.get("description", ""),
-            "created_at": now,
-            "is_active": 1
-        }
-        
-        self.client.execute(
-            """
-            INSERT INTO devices 
-            (device_id, name, location, description, created_at, is_active)
-            VALUES
-            """,
-            [(
-                device["device_id"],
-                device["name"],
-                device["location"],
-                device["description"],
-                device["created_at"],
-                device["is_active"]
-            )]
-        )
-        
-        return Device(**device)
-    
-    async def get_device(self, device_id: str) -> Optional[Device]:
-        result = self.client.execute(
-            """
-            SELECT 
-                device_id, 
-                name, 
-                location, 
-                description, 
-                created_at,
-                is_active
-            FROM devices
-            WHERE device_id = %(device_id)s
-            LIMIT 1
-            """,
-            {"device_id": device_id}
-        )
-        
-        if not result:
-            return None
-            
-        row = result[0]
-        return Device(
-            device_id=row[0],
-            name=row[1],
-            location=row[2],
-            description=row[3],
-            created_at=row[4],
-            is_active=bool(row[5])
-        )
-    
-    async def get_all_devices(self, limit: int = 100) -> List[Device]:
-        result = self.client.execute(
-            """
-            SELECT 
-                device_id, 
-                name, 
-                location, 
-                description, 
-                created_at,
-                is_active
-            FROM devices
-            ORDER BY created_at DESC
-            LIMIT %(limit)s
-            """,
-            {"limit": limit}
-        )
-        
-        return [
-            Device(
-                device_id=row[0],
-                name=row[1],
-                location=row[2],
-                description=row[3],
-                created_at=row[4],
-                is_active=bool(row[5])
+    async def get_legacy_devices(self) -> Optional[List[Device]]:
+        # The devices table from before devices moved to Postgres, if it is
+        # still there. Older deployments have the plain MergeTree layout,
+        # newer ones the versioned ReplacingMergeTree with deleted markers.
+        columns = {
+            name for name, in await self._execute(
+                """
+                SELECT name
+                FROM system.columns
+                WHERE database = currentDatabase() AND table = 'devices'
+                """
             )
-            for row in result
-        ]
-    
-    async def update_device(self, device_id: str, device_data: dict) -> Optional[Device]:
-        device = await self.get_device(device_id)
-        if not device:
+        }
+        if not columns:
             return None
-
-        update_parts = []
-        params = {"device_id": device_id}
         
-        if "name" in device_data:
-            update_parts.append("name = %(name)s")
-            params["name"] = device_data["name"]
-            
-        if "location" in device_data:
-            update_parts.append("location = %(location)s")
-            params["location"] = device_data["location"]
-            
-        if "description" in device_data:
-            update_parts.append("description = %(description)s")
-            params["description"] = device_data["description"]
-            
-        if "is_active" in device_data:
-            update_parts.append("is_active = %(is_active)s")
-            params["is_active"] = 1 if device_data["is_active"] else 0
-        
-        if update_parts:
-            update_query = f"ALTER TABLE devices UPDATE {', '.join(update_parts)} WHERE device_id = %(device_id)s"
-            self.client.execute(update_query, params)
-
-        return await self.get_device(device_id)
-        
-    async def delete_device(self, device_id: str) -> bool:
-        device = await self.get_device(device_id)
-        if not device:
-            return False
+        query = "SELECT device_id, name, location, description, created_at, is_active FROM devices"
+        if "is_deleted" in columns:
+            query += " FINAL WHERE is_deleted = 0"
+        return _devices_from_rows(await self._execute(query))
 
-        self.client.execute(
-            "ALTER TABLE devices DELETE WHERE device_id = %(device_id)s",
-            {"device_id": device_id}
-        )
-        
-        return True
+    async def retire_legacy_devices(self) -> None:
+        await self._execute("RENAME TABLE devices TO devices_migrated")
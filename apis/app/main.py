@@ -1,18 +1,21 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from fastapi import FastAPI, Depends, Query, HTTPException, status, Form, Body
+import orjson
+
+from fastapi import FastAPI, Depends, Query, HTTPException, status, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from loguru import logger
 
 from app.auth import authenticate_user, create_access_token, get_current_active_user, require_admin
 from app.config import config
 from app.database import ClickHouseClient, PostgresClient
-from app.dependencies import get_db_client, get_postgres_client
+from app.dependencies import clickhouse_client, get_db_client, get_postgres_client, postgres_client
 from app.models import (
-    SensorData, SensorDataResponse, SensorStats, SensorStatsResponse,
-    UserCreate, User, Token, DeviceCreate, Device, DeviceResponse
+    SensorData, SensorDataResponse, SensorStats, SensorStatsResponse, MetadataResponse,
+    UserCreate, User, Token, DeviceCreate, DeviceUpdate, Device, DeviceResponse
 )
 
 
@@ -31,6 +34,32 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def startup():
+    await clickhouse_client.warm_up()
+    await _copy_legacy_devices()
+
+
+async def _copy_legacy_devices():
+    # Devices used to live in ClickHouse. Rows left there are copied into
+    # Postgres once, then the old table is renamed so later starts skip it.
+    try:
+        devices = await clickhouse_client.get_legacy_devices()
+        if devices is None:
+            return
+        await postgres_client.connect()
+        await postgres_client.import_devices(devices)
+        await clickhouse_client.retire_legacy_devices()
+        logger.info(f"Copied {len(devices)} devices from ClickHouse to PostgreSQL")
+    except Exception as e:
+        logger.warning(f"Could not copy devices from ClickHouse: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await clickhouse_client.close()
+
+
 @app.post("/auth/register", response_model=User, status_code=status.HTTP_201_CREATED, tags=["auth"])
 async def register_user(
     user_data: UserCreate,
@@ -95,7 +124,7 @@ async def get_current_user_info(current_user: User = Depends(get_current_active_
 async def create_device(
     device_data: DeviceCreate,
     current_user: User = Depends(require_admin),
-    db: ClickHouseClient = Depends(get_db_client)
+    db: PostgresClient = Depends(get_postgres_client)
 ):
     try:
         device = await db.create_device(device_data.model_dump())
@@ -117,7 +146,7 @@ async def create_device(
 async def get_devices(
     limit: int = Query(default=100, ge=1, le=1000),
     current_user: User = Depends(get_current_active_user),
-    db: ClickHouseClient = Depends(get_db_client)
+    db: PostgresClient = Depends(get_postgres_client)
 ):
     try:
         devices = await db.get_all_devices(limit=limit)
@@ -134,7 +163,7 @@ async def get_devices(
 async def get_device(
     device_id: str,
     current_user: User = Depends(get_current_active_user),
-    db: ClickHouseClient = Depends(get_db_client)
+    db: PostgresClient = Depends(get_postgres_client)
 ):
     try:
         device = await db.get_device(device_id)
@@ -157,12 +186,12 @@ async def get_device(
 @app.put("/devices/{device_id}", response_model=Device, tags=["devices"])
 async def update_device(
     device_id: str,
-    device_data: dict = Body(...),
+    device_data: DeviceUpdate,
     current_user: User = Depends(require_admin),
-    db: ClickHouseClient = Depends(get_db_client)
+    db: PostgresClient = Depends(get_postgres_client)
 ):
     try:
-        device = await db.update_device(device_id, device_data)
+        device = await db.update_device(device_id, device_data.model_dump(exclude_unset=True))
         if not device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -183,7 +212,7 @@ async def update_device(
 async def delete_device(
     device_id: str,
     current_user: User = Depends(require_admin),
-    db: ClickHouseClient = Depends(get_db_client)
+    db: PostgresClient = Depends(get_postgres_client)
 ):
     try:
         success = await db.delete_device(device_id)
@@ -202,6 +231,10 @@ async def delete_device(
         )
 
 
+def _json_response(content: Any) -> Response:
+    return Response(orjson.dumps(content), media_type="application/json")
+
+
 @app.get("/sensor-data/latest", response_model=SensorDataResponse, tags=["sensor-data"])
 async def get_latest_sensor_data(
     device_id: Optional[str] = None,
@@ -218,7 +251,9 @@ async def get_latest_sensor_data(
             location=location,
             limit=limit
         )
-        return SensorDataResponse(data=data, total_count=len(data))
+        # Returned as a Response so FastAPI doesn't re-validate and re-encode
+        # the rows; response_model still documents the shape.
+        return _json_response({"data": data, "total_count": len(data)})
     except Exception as e:
         logger.error(f"Error in get_latest_sensor_data: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -250,12 +285,67 @@ async def get_historical_sensor_data(
             location=location,
             limit=limit
         )
-        return SensorDataResponse(data=data, total_count=len(data))
+        return _json_response({"data": data, "total_count": len(data)})
     except Exception as e:
         logger.error(f"Error in get_historical_sensor_data: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _ndjson(
+    first: List[Dict[str, Any]], batches: AsyncIterator[List[Dict[str, Any]]]
+) -> AsyncIterator[bytes]:
+    batch = first
+    try:
+        while True:
+            yield b"".join(orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE) for item in batch)
+            batch = await batches.__anext__()
+    except StopAsyncIteration:
+        pass
+    except Exception as e:
+        # Headers are already sent; the client sees a truncated stream.
+        logger.error(f"Error in stream_historical_sensor_data: {e}")
+    finally:
+        await batches.aclose()
+
+
+@app.get("/sensor-data/historical/stream", tags=["sensor-data"])
+async def stream_historical_sensor_data(
+    from_timestamp: datetime,
+    to_timestamp: datetime,
+    device_id: Optional[str] = None,
+    sensor_type: Optional[str] = None,
+    location: Optional[str] = None,
+    limit: int = Query(default=1000, ge=1, le=100000),
+    current_user: User = Depends(get_current_active_user),
+    db: ClickHouseClient = Depends(get_db_client)
+):
+    if from_timestamp >= to_timestamp:
+        raise HTTPException(
+            status_code=400, 
+            detail="from_timestamp must be earlier than to_timestamp"
+        )
+    
+    batches = db.stream_historical_data(
+        from_timestamp=from_timestamp,
+        to_timestamp=to_timestamp,
+        device_id=device_id,
+        sensor_type=sensor_type,
+        location=location,
+        limit=limit
+    )
+    # Pull the first block before responding, so query errors still turn
+    # into a 500 rather than an empty 200 stream.
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = []
+    except Exception as e:
+        logger.error(f"Error in stream_historical_sensor_data: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return StreamingResponse(_ndjson(first, batches), media_type="application/x-ndjson")
+
+
 @app.get("/sensor-data/stats", response_model=SensorStatsResponse, tags=["sensor-data"])
 async def get_sensor_stats(
     from_timestamp: datetime,
@@ -286,6 +376,20 @@ async def get_sensor_stats(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/metadata/all", response_model=MetadataResponse, tags=["metadata"])
+async def get_all_metadata(
+    current_user: User = Depends(get_current_active_user),
+    db: ClickHouseClient = Depends(get_db_client)
+):
+    # Devices, sensor types and locations in one request for the dashboard's
+    # initial load.
+    try:
+        return await db.get_all_metadata()
+    except Exception as e:
+        logger.error(f"Error in get_all_metadata: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/metadata/devices", response_model=List[str], tags=["metadata"])
 async def get_device_ids(
     current_user: User = Depends(get_current_active_user),
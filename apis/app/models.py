@@ -2,7 +2,7 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional, Dict, Any, List
 
-from pydantic import BaseModel, Field, EmailStr, SecretStr
+from pydantic import BaseModel, Field, EmailStr, SecretStr, field_validator
 
 
 class SensorData(BaseModel):
@@ -62,11 +62,21 @@ class SensorStatsResponse(BaseModel):
     data: List[SensorStats]
 
 
+class MetadataResponse(BaseModel):
+    devices: List[str]
+    sensor_types: List[str]
+    locations: List[str]
+
+
 class UserRole(str, Enum):
     USER = "user"
     ADMIN = "admin"
 
 
+# Plain dict lookup for decoding stored / token role strings on hot paths.
+ROLE_MAP: Dict[str, UserRole] = {role.value: role for role in UserRole}
+
+
 class UserBase(BaseModel):
     username: str
     email: EmailStr
@@ -93,6 +103,10 @@ class UserInDB(UserBase):
     created_at: datetime
     last_login: Optional[datetime] = None
     is_active: bool = True
+    
+    class Config:
+        frozen = True
+        extra = "forbid"
 
 
 class User(UserBase):
@@ -101,6 +115,8 @@ class User(UserBase):
     is_active: bool
     
     class Config:
+        frozen = True
+        extra = "forbid"
         json_schema_extra = {
             "example": {
                 "username": "johndoe",
@@ -129,6 +145,10 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: str
     role: UserRole
+    
+    class Config:
+        frozen = True
+        extra = "forbid"
 
 
 class DeviceBase(BaseModel):
@@ -150,6 +170,22 @@ class DeviceCreate(DeviceBase):
         }
 
 
+class DeviceUpdate(BaseModel):
+    # Only the fields present in the request are written; an explicit null
+    # clears location or description.
+    name: Optional[str] = None
+    location: Optional[str] = None
+    description: Optional[str] = None
+    is_active: Optional[bool] = None
+
+    @field_validator("name", "is_active")
+    @classmethod
+    def not_null(cls, value):
+        if value is None:
+            raise ValueError("may not be null")
+        return value
+
+
 class Device(DeviceBase):
     created_at: datetime
     is_active: bool = True
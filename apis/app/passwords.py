@@ -0,0 +1,55 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from app.config import config
+
+
+# argon2id, argon2-cffi's default variant. Costs are configurable; raising
+# them makes existing hashes report needs_rehash and upgrade on next login.
+_hasher = PasswordHasher(
+    time_cost=config.jwt.argon2_time_cost,
+    memory_cost=config.jwt.argon2_memory_cost,
+    parallelism=config.jwt.argon2_parallelism,
+)
+
+# Hashing is CPU-bound and argon2 needs its memory cost per call. Signup and
+# login share one pool sized to the cores, so bursts queue here instead of
+# blocking the event loop, starving the default threadpool, or multiplying
+# memory use. argon2-cffi and bcrypt release the GIL, so threads hash in
+# parallel without a process pool.
+_hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="password-hash")
+
+# Accounts created before the switch to argon2 still hold bcrypt hashes.
+_BCRYPT_PREFIX = "$2"
+
+
+def hash_password(password: str) -> str:
+    return _hasher.hash(password)
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    if hashed_password.startswith(_BCRYPT_PREFIX):
+        return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+    try:
+        return _hasher.verify(hashed_password, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    return hashed_password.startswith(_BCRYPT_PREFIX) or _hasher.check_needs_rehash(hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, hash_password, password)
+
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(
+        _hash_pool, verify_password, password, hashed_password
+    )
@@ -10,5 +10,10 @@ if __name__ == "__main__":
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=config.debug
+        reload=config.debug,
+        # libuv event loop and C HTTP parser instead of asyncio's default
+        # loop and the pure-Python h11.
+        loop="uvloop",
+        http="httptools",
+        workers=config.workers,
     )
@@ -0,0 +1,64 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from app.database import ClickHouseClient
+
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+
+class HourSplitTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = ClickHouseClient()
+        self.calls = []
+
+        async def fetch(query, params, build, settings=None):
+            self.calls.append((query, params))
+            return []
+
+        self.client._fetch = fetch
+
+    async def test_stats_rollup_bounds_are_whole_utc_hours(self):
+        await self.client.get_aggregated_stats(
+            datetime(2024, 1, 1, 10, 0, tzinfo=IST),
+            datetime(2024, 1, 1, 14, 0, tzinfo=IST),
+        )
+
+        (query, params), = self.calls
+        self.assertIn("sensor_stats_hourly", query)
+        # 10:00+05:30 is 04:30 UTC: the raw edge must run up to 05:00 UTC,
+        # where the server's toStartOfHour buckets begin.
+        self.assertEqual(params["from_ts"], datetime(2024, 1, 1, 4, 30, tzinfo=timezone.utc))
+        self.assertEqual(params["full_from"], datetime(2024, 1, 1, 5, 0, tzinfo=timezone.utc))
+        self.assertEqual(params["full_to"], datetime(2024, 1, 1, 8, 0, tzinfo=timezone.utc))
+        self.assertEqual(params["to_ts"], datetime(2024, 1, 1, 8, 30, tzinfo=timezone.utc))
+
+    async def test_historical_pieces_are_contiguous_in_utc(self):
+        await self.client.get_historical_data(
+            datetime(2024, 1, 1, 10, 0, tzinfo=IST),
+            datetime(2024, 1, 1, 14, 0, tzinfo=IST),
+        )
+
+        ranges = [(params["from_ts"], params["to_ts"]) for _, params in self.calls]
+        self.assertEqual(ranges, [
+            (datetime(2024, 1, 1, 8, 0, tzinfo=timezone.utc), datetime(2024, 1, 1, 8, 30, tzinfo=timezone.utc)),
+            (datetime(2024, 1, 1, 5, 0, tzinfo=timezone.utc), datetime(2024, 1, 1, 7, 59, 59, tzinfo=timezone.utc)),
+            (datetime(2024, 1, 1, 4, 30, tzinfo=timezone.utc), datetime(2024, 1, 1, 4, 59, 59, tzinfo=timezone.utc)),
+        ])
+
+    async def test_historical_short_or_aligned_window_is_one_query(self):
+        await self.client.get_historical_data(
+            datetime(2024, 1, 1, 10, 15, tzinfo=IST),
+            datetime(2024, 1, 1, 11, 0, tzinfo=IST),
+        )
+        await self.client.get_historical_data(
+            datetime(2024, 1, 1, 4, 0, tzinfo=timezone.utc),
+            datetime(2024, 1, 1, 8, 0, tzinfo=timezone.utc),
+        )
+
+        self.assertEqual(len(self.calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,6 +11,7 @@ class MQTTConfig(BaseModel):
     username: str = os.getenv("MQTT_USERNAME", "")
     password: str = os.getenv("MQTT_PASSWORD", "")
     topics: list[str] = os.getenv("MQTT_TOPICS", "sensors/+/data").split(",")
+    queue_size: int = int(os.getenv("MQTT_QUEUE_SIZE", "10000"))
 
 class ClickHouseConfig(BaseModel):
     host: str = os.getenv("CLICKHOUSE_HOST", "localhost")
@@ -18,6 +19,11 @@ class ClickHouseConfig(BaseModel):
     user: str = os.getenv("CLICKHOUSE_USER", "default")
     password: str = os.getenv("CLICKHOUSE_PASSWORD", "")
     database: str = os.getenv("CLICKHOUSE_DATABASE", "iot_monitoring")
+    batch_size: int = int(os.getenv("CLICKHOUSE_BATCH_SIZE", "1000"))
+    flush_interval: float = float(os.getenv("CLICKHOUSE_FLUSH_INTERVAL", "5"))
+    # Rows kept for retry while ClickHouse is unavailable.
+    max_buffered_rows: int = int(os.getenv("CLICKHOUSE_MAX_BUFFERED_ROWS", "100000"))
+    compression: str = os.getenv("CLICKHOUSE_COMPRESSION", "lz4")
 
 class Config(BaseModel):
     mqtt: MQTTConfig = MQTTConfig()
@@ -1,3 +1,5 @@
+import threading
+
 from clickhouse_driver import Client
 from loguru import logger
 
@@ -5,6 +7,42 @@ from config import config
 from models import SensorData
 
 
+_COLUMNS = ("device_id", "sensor_type", "value", "unit", "timestamp", "location", "metadata")
+
+# Small batches (timer flushes at low traffic, several ingest instances)
+# are coalesced by the server into fewer parts. The flush waits for the
+# server to commit the rows, so a failed insert is seen by flush() and its
+# rows are kept for the next attempt; it runs on the flusher thread, so the
+# wait doesn't hold up ingestion.
+_INSERT_SETTINGS = {"async_insert": 1, "wait_for_async_insert": 1}
+
+# Shared with test/setup_db.py so the service and the setup script can't
+# create the table with different schemas.
+SENSOR_DATA_SCHEMA = """
+    (
+        device_id LowCardinality(String),
+        sensor_type LowCardinality(String),
+        value Float64 CODEC(Gorilla, LZ4),
+        unit LowCardinality(String),
+        timestamp DateTime CODEC(DoubleDelta, LZ4),
+        location LowCardinality(String),
+        metadata String CODEC(ZSTD(3)),
+        event_date Date DEFAULT toDate(timestamp),
+        -- location is not part of the sort key; lets location
+        -- filters skip granules that can't contain the value.
+        INDEX idx_location location TYPE set(1000) GRANULARITY 4,
+        -- Time-ordered copy for "latest N" reads that don't filter
+        -- on device_id / sensor_type.
+        PROJECTION by_time (SELECT * ORDER BY timestamp)
+    ) ENGINE = MergeTree()
+    PARTITION BY toYYYYMM(timestamp)
+    ORDER BY (device_id, sensor_type, timestamp)
+"""
+SENSOR_DATA_DDL = (
+    f"CREATE TABLE IF NOT EXISTS {config.clickhouse.database}.sensor_data {SENSOR_DATA_SCHEMA}"
+)
+
+
 class ClickHouseClient:
 
     def __init__(self):
@@ -14,8 +52,33 @@ class ClickHouseClient:
             user=config.clickhouse.user,
             password=config.clickhouse.password,
             database=config.clickhouse.database,
+            # Batched inserts are sent as compressed blocks.
+            compression=config.clickhouse.compression or False,
         )
         self._ensure_table_exists()
+        self._insert_sql = (
+            f"INSERT INTO {config.clickhouse.database}.sensor_data "
+            f"({', '.join(_COLUMNS)}) VALUES"
+        )
+
+        # Rows are buffered and written in batches: single-row INSERTs into
+        # MergeTree create a part per message and are far slower. The buffer
+        # is kept per column, the layout the native protocol sends, so the
+        # driver doesn't have to transpose rows on every flush.
+        self._columns: list[list] = [[] for _ in _COLUMNS]
+        self._batch_size = config.clickhouse.batch_size
+        self._max_buffered = config.clickhouse.max_buffered_rows
+        self._buffered = 0
+        self._dropped = 0
+        self._buffer_lock = threading.Lock()
+        # Only the flusher thread talks to ClickHouse. A full buffer wakes it
+        # early, so the MQTT thread keeps parsing messages while a batch is
+        # being written instead of waiting on the INSERT itself.
+        self._client_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
 
     def _ensure_table_exists(self):
         try:
@@ -23,49 +86,85 @@ class ClickHouseClient:
                 f"CREATE DATABASE IF NOT EXISTS {config.clickhouse.database}"
             )
             
-            self.client.execute(
-                f"""
-                CREATE TABLE IF NOT EXISTS {config.clickhouse.database}.sensor_data (
-                    device_id String,
-                    sensor_type String,
-                    value Float64,
-                    unit String,
-                    timestamp DateTime,
-                    location String,
-                    metadata String,
-                    event_date Date DEFAULT toDate(timestamp)
-                ) ENGINE = MergeTree()
-                PARTITION BY toYYYYMM(timestamp)
-                ORDER BY (device_id, sensor_type, timestamp)
-                """
-            )
+            self.client.execute(SENSOR_DATA_DDL)
             logger.info("ClickHouse table check/creation completed")
         except Exception as e:
             logger.error(f"Error setting up ClickHouse table: {e}")
             raise
 
     def insert_sensor_data(self, sensor_data: SensorData):
-        try:
-            data_dict = sensor_data.to_clickhouse_dict()
-            self.client.execute(
-                f"""
-                INSERT INTO {config.clickhouse.database}.sensor_data
-                (device_id, sensor_type, value, unit, timestamp, location, metadata)
-                VALUES
-                """,
-                [
-                    (
-                        data_dict["device_id"],
-                        data_dict["sensor_type"],
-                        data_dict["value"],
-                        data_dict["unit"],
-                        data_dict["timestamp"],
-                        data_dict["location"],
-                        data_dict["metadata"],
-                    )
-                ],
-            )
-            logger.debug(f"Inserted data for device {data_dict['device_id']}")
-        except Exception as e:
-            logger.error(f"Error inserting data into ClickHouse: {e}")
-            raise
+        row = sensor_data.to_clickhouse_row()
+        with self._buffer_lock:
+            # While an INSERT hangs the flusher can't drain the buffer, so the
+            # cap is enforced here too: the oldest row makes room for the new one.
+            if self._buffered >= self._max_buffered:
+                for column in self._columns:
+                    del column[:1]
+                self._buffered -= 1
+                self._dropped += 1
+            for column, value in zip(self._columns, row):
+                column.append(value)
+            self._buffered += 1
+            should_flush = self._buffered >= self._batch_size
+        if should_flush:
+            self._wake.set()
+
+    def flush(self) -> bool:
+        with self._buffer_lock:
+            columns, self._columns = self._columns, [[] for _ in _COLUMNS]
+            count, self._buffered = self._buffered, 0
+            dropped, self._dropped = self._dropped, 0
+        # Logged once per flush rather than once per dropped message.
+        if dropped:
+            logger.error(f"Buffer over {self._max_buffered} rows, dropped {dropped} oldest rows")
+        if not count:
+            return True
+
+        # close() flushes the remainder from the main thread; the Client must
+        # never run two queries at once.
+        with self._client_lock:
+            try:
+                self.client.execute(
+                    self._insert_sql, columns, columnar=True, settings=_INSERT_SETTINGS
+                )
+                logger.info(f"Inserted {count} rows into ClickHouse")
+                return True
+            except Exception as e:
+                logger.error(f"Error inserting {count} rows into ClickHouse: {e}")
+
+        self._requeue(columns, count)
+        return False
+
+    def _requeue(self, columns: list[list], count: int):
+        # The failed batch goes back in front of whatever arrived meanwhile.
+        # The buffer is capped so a long outage can't exhaust memory; past
+        # the cap the oldest rows are dropped.
+        with self._buffer_lock:
+            for column, newer in zip(columns, self._columns):
+                column.extend(newer)
+            self._columns = columns
+            self._buffered += count
+            dropped = self._buffered - self._max_buffered
+            if dropped > 0:
+                for column in self._columns:
+                    del column[:dropped]
+                self._buffered = self._max_buffered
+        if dropped > 0:
+            logger.error(f"Buffer over {self._max_buffered} rows, dropped {dropped} oldest rows")
+
+    def _flush_periodically(self):
+        while not self._stop.is_set():
+            self._wake.wait(config.clickhouse.flush_interval)
+            self._wake.clear()
+            if not self.flush():
+                # Back off a full interval before retrying, even if new rows
+                # keep waking the flusher.
+                self._stop.wait(config.clickhouse.flush_interval)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._flusher.join()
+        if not self.flush():
+            logger.error(f"Dropping {self._buffered} unflushed rows on shutdown")
+        self.client.disconnect()
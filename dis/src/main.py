@@ -1,5 +1,6 @@
+import signal
 import sys
-import time
+import threading
 from loguru import logger
 
 from config import config
@@ -22,23 +23,37 @@ class DataIngestionService:
         
         self.clickhouse_client = ClickHouseClient()
         self.mqtt_client = MQTTClient(on_message_callback=self.process_sensor_data)
+        
+        # The main thread just blocks until a signal asks it to stop; paho's
+        # network loop and the flusher do all the work on their own threads.
+        self._stop = threading.Event()
+        signal.signal(signal.SIGINT, self.shutdown)
+        signal.signal(signal.SIGTERM, self.shutdown)
 
     def start(self):
         logger.info("Starting Data Ingestion Service")
         self.mqtt_client.connect()
         logger.info("Service started and listening for messages")
         
-        while True:
-            time.sleep(1)
+        try:
+            self._stop.wait()
+            logger.info("Stopping Data Ingestion Service")
+        finally:
+            self.stop()
+
+    def shutdown(self, signum=None, frame=None):
+        self._stop.set()
+
+    def stop(self):
+        try:
+            self.mqtt_client.disconnect()
+        finally:
+            self.clickhouse_client.close()
 
     def process_sensor_data(self, sensor_data: SensorData):
         try:
+            # No per-message logging: the flush logs one line per batch.
             self.clickhouse_client.insert_sensor_data(sensor_data)
-            
-            logger.info(
-                f"Processed data from device {sensor_data.device_id}, "
-                f"sensor {sensor_data.sensor_type}"
-            )
         except Exception as e:
             logger.error(f"Error processing sensor data: {e}")
 
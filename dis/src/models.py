@@ -1,5 +1,7 @@
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
 from pydantic import BaseModel, Field
 
 
@@ -12,13 +14,16 @@ class SensorData(BaseModel):
     location: Optional[str] = None
     metadata: Dict[str, Any] = Field(default_factory=dict)
 
-    def to_clickhouse_dict(self) -> Dict[str, Any]:
-        return {
-            "device_id": self.device_id,
-            "sensor_type": self.sensor_type,
-            "value": self.value,
-            "unit": self.unit,
-            "timestamp": self.timestamp,
-            "location": self.location or "",
-            "metadata": str(self.metadata),
-        }
+    # Values in sensor_data column order, read straight off the validated
+    # fields: called once per message, so no intermediate dict. metadata is
+    # stored as JSON (not the dict's repr) so it can be parsed back.
+    def to_clickhouse_row(self) -> Tuple[Any, ...]:
+        return (
+            self.device_id,
+            self.sensor_type,
+            self.value,
+            self.unit,
+            self.timestamp,
+            self.location or "",
+            orjson.dumps(self.metadata).decode(),
+        )
@@ -1,13 +1,24 @@
-import json
+import queue
+import socket
+import threading
 from typing import Callable, Optional
 
+import orjson
 import paho.mqtt.client as mqtt
 from loguru import logger
+from pydantic import ValidationError
 
 from config import config
 from models import SensorData
 
 
+def _missing_device_id(error: ValidationError) -> bool:
+    return any(
+        e["type"] == "missing" and e["loc"] == ("device_id",)
+        for e in error.errors()
+    )
+
+
 class MQTTClient:
 
     def __init__(self, on_message_callback: Optional[Callable] = None):
@@ -23,6 +34,17 @@ class MQTTClient:
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
+        
+        # paho's network thread only enqueues raw payloads; parsing,
+        # validation and buffering run on a worker so the socket keeps
+        # being drained while a message is processed. One worker: the
+        # work holds the GIL, so more threads wouldn't parse faster. The
+        # queue is bounded: if the worker falls behind, new messages are
+        # dropped and counted rather than growing memory without limit.
+        self._messages = queue.Queue(maxsize=config.mqtt.queue_size)
+        self._dropped = 0
+        self._worker = threading.Thread(target=self._process_messages, daemon=True)
+        self._worker.start()
 
     def connect(self):
         try:
@@ -42,30 +64,53 @@ class MQTTClient:
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             logger.info("Connected to MQTT broker")
-            for topic in config.mqtt.topics:
-                client.subscribe(topic)
-                logger.info(f"Subscribed to topic: {topic}")
+            # paho opens a new socket on every reconnect, so this runs here
+            # rather than once after connect(). Without Nagle, acks and pings
+            # aren't held back waiting to coalesce with other small writes.
+            client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # One SUBSCRIBE packet for all filters instead of one per topic.
+            client.subscribe([(topic, 0) for topic in config.mqtt.topics])
+            logger.info(f"Subscribed to topics: {', '.join(config.mqtt.topics)}")
         else:
             logger.error(f"Failed to connect to MQTT broker, return code: {rc}")
 
     def _on_message(self, client, userdata, msg):
         try:
-            logger.debug(f"Received message on topic {msg.topic}")
-            payload = msg.payload.decode("utf-8")
-            data = json.loads(payload)
-            
-            if "device_id" not in data and "/" in msg.topic:
-                topic_parts = msg.topic.split("/")
-                if len(topic_parts) >= 2:
-                    data["device_id"] = topic_parts[1]
-            
-            sensor_data = SensorData(**data)
+            self._messages.put_nowait((msg.topic, msg.payload))
+        except queue.Full:
+            self._dropped += 1
+            if self._dropped == 1 or self._dropped % 1000 == 0:
+                logger.warning(
+                    f"Message queue full, dropped {self._dropped} messages so far"
+                )
+
+    def _process_messages(self):
+        while (message := self._messages.get()) is not None:
+            self._handle_message(*message)
+
+    def _handle_message(self, topic: str, payload: bytes):
+        try:
+            # Parse and validate the raw bytes in one pass; the dict route
+            # is only needed when device_id has to come from the topic.
+            try:
+                sensor_data = SensorData.model_validate_json(payload)
+            except ValidationError as e:
+                # sensors/<device_id>/data: the second topic level.
+                _, sep, rest = topic.partition("/")
+                if not _missing_device_id(e) or not sep:
+                    raise
+                data = orjson.loads(payload)
+                data["device_id"] = rest.partition("/")[0]
+                sensor_data = SensorData.model_validate(data)
             
             if self.on_message_callback:
                 self.on_message_callback(sensor_data)
                 
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON in message: {payload}")
+        except ValidationError as e:
+            if any(error["type"] == "json_invalid" for error in e.errors()):
+                logger.error(f"Invalid JSON in message: {payload!r}")
+            else:
+                logger.error(f"Error processing MQTT message: {e}")
         except Exception as e:
             logger.error(f"Error processing MQTT message: {e}")
 
@@ -81,6 +126,9 @@ class MQTTClient:
         try:
             self.client.loop_stop()
             self.client.disconnect()
+            # Let the worker finish what was already received.
+            self._messages.put(None)
+            self._worker.join()
             logger.info("Disconnected from MQTT broker")
         except Exception as e:
             logger.error(f"Error disconnecting from MQTT broker: {e}")
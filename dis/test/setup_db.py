@@ -1,8 +1,159 @@
 from clickhouse_driver import Client
 from loguru import logger
+import re
 import sys
 
 from config import config
+from database import SENSOR_DATA_SCHEMA
+
+
+def _create_materialized_view(client, view: str, target: str, select: str):
+    database = config.clickhouse.database
+    if client.execute(f"EXISTS TABLE {database}.{view}")[0][0]:
+        return
+    
+    # Backfill the target from existing rows before the view starts
+    # capturing new inserts.
+    client.execute(f"INSERT INTO {database}.{target} {select}")
+    client.execute(
+        f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {database}.{view}
+        TO {database}.{target}
+        AS {select}
+        """
+    )
+
+
+# Column types for tables created before the schema moved to LowCardinality
+# and per-column codecs: (type, codec) pairs applied with MODIFY COLUMN, or
+# by rebuilding the table when a key column's type changes.
+_SENSOR_DATA_COLUMNS = {
+    "device_id": ("LowCardinality(String)", ""),
+    "sensor_type": ("LowCardinality(String)", ""),
+    "value": ("Float64", "CODEC(Gorilla, LZ4)"),
+    "unit": ("LowCardinality(String)", ""),
+    "timestamp": ("DateTime", "CODEC(DoubleDelta, LZ4)"),
+    "location": ("LowCardinality(String)", ""),
+    "metadata": ("String", "CODEC(ZSTD(3))"),
+}
+
+_DIMENSION_COLUMNS = {
+    "device_id": ("LowCardinality(String)", ""),
+    "sensor_type": ("LowCardinality(String)", ""),
+    "location": ("LowCardinality(String)", ""),
+}
+
+
+def _migrate_columns(client, table: str, schema: str, columns: dict):
+    database = config.clickhouse.database
+    current = {
+        name: (column_type, codec, is_key)
+        for name, column_type, codec, is_key in client.execute(
+            """
+            SELECT name, type, compression_codec, is_in_sorting_key OR is_in_partition_key
+            FROM system.columns
+            WHERE database = %(database)s AND table = %(table)s
+            """,
+            {"database": database, "table": table}
+        )
+    }
+    
+    outdated = [
+        name
+        for name, (column_type, codec) in columns.items()
+        if name in current
+        and (current[name][0] != column_type or (codec and not current[name][1]))
+    ]
+    # ClickHouse refuses to change the type of a sort or partition key
+    # column in place; those tables are copied into the current schema.
+    if any(current[name][2] and current[name][0] != columns[name][0] for name in outdated):
+        _rebuild_table(client, table, schema, list(current))
+        return
+    
+    changes = [
+        f"MODIFY COLUMN {name} {columns[name][0]} {columns[name][1]}".rstrip()
+        for name in outdated
+    ]
+    if changes:
+        client.execute(f"ALTER TABLE {database}.{table} {', '.join(changes)}")
+        logger.info(f"Migrated columns of '{table}': {', '.join(changes)}")
+
+
+def _rebuild_table(client, table: str, schema: str, columns: list):
+    database = config.clickhouse.database
+    rebuilt = f"{table}_rebuild"
+    # Materialized views reading from or writing into the table follow it by
+    # UUID, so they'd keep pointing at the old copy after the exchange. They
+    # are dropped and recreated from their stored definitions, without a
+    # second backfill. Rows inserted while this runs are not copied; stop
+    # ingestion first.
+    reference = re.compile(rf"\b(?:FROM|TO) {re.escape(database)}\.{re.escape(table)}\b")
+    views = [
+        (name, query)
+        for name, query in client.execute(
+            """
+            SELECT name, create_table_query
+            FROM system.tables
+            WHERE database = %(database)s AND engine = 'MaterializedView'
+            """,
+            {"database": database}
+        )
+        if reference.search(query)
+    ]
+    for name, _ in views:
+        client.execute(f"DROP VIEW {database}.{name}")
+    
+    client.execute(f"DROP TABLE IF EXISTS {database}.{rebuilt}")
+    client.execute(f"CREATE TABLE {database}.{rebuilt} {schema}")
+    column_list = ", ".join(columns)
+    client.execute(
+        f"INSERT INTO {database}.{rebuilt} ({column_list}) "
+        f"SELECT {column_list} FROM {database}.{table}"
+    )
+    client.execute(f"EXCHANGE TABLES {database}.{table} AND {database}.{rebuilt}")
+    client.execute(f"DROP TABLE {database}.{rebuilt}")
+    
+    for _, query in views:
+        client.execute(query)
+    logger.info(f"Rebuilt '{table}' with the current schema")
+
+
+def _create_table(client, table: str, schema: str, columns: dict):
+    client.execute(f"CREATE TABLE IF NOT EXISTS {config.clickhouse.database}.{table} {schema}")
+    _migrate_columns(client, table, schema, columns)
+
+
+def _get_create_query(client, table: str) -> str:
+    return client.execute(
+        """
+        SELECT create_table_query
+        FROM system.tables
+        WHERE database = %(database)s AND name = %(table)s
+        """,
+        {"database": config.clickhouse.database, "table": table}
+    )[0][0]
+
+
+def _add_index(client, table: str, index: str, definition: str):
+    database = config.clickhouse.database
+    if f"INDEX {index} " in _get_create_query(client, table):
+        return
+    
+    client.execute(f"ALTER TABLE {database}.{table} ADD INDEX {index} {definition}")
+    client.execute(f"ALTER TABLE {database}.{table} MATERIALIZE INDEX {index}")
+    logger.info(f"Added index '{index}' to '{table}'")
+
+
+def _add_projection(client, table: str, projection: str, select: str):
+    database = config.clickhouse.database
+    if f"PROJECTION {projection} " in _get_create_query(client, table):
+        return
+    
+    # Tables created before the projection existed get it added and built
+    # for their existing parts once.
+    client.execute(f"ALTER TABLE {database}.{table} ADD PROJECTION {projection} ({select})")
+    client.execute(f"ALTER TABLE {database}.{table} MATERIALIZE PROJECTION {projection}")
+    logger.info(f"Added projection '{projection}' to '{table}'")
 
 
 def setup_database():
@@ -24,29 +175,18 @@ def setup_database():
         )
         logger.info(f"Database '{config.clickhouse.database}' created or already exists")
         
-        client.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS {config.clickhouse.database}.sensor_data (
-                device_id String,
-                sensor_type String,
-                value Float64,
-                unit String,
-                timestamp DateTime,
-                location String,
-                metadata String,
-                event_date Date DEFAULT toDate(timestamp)
-            ) ENGINE = MergeTree()
-            PARTITION BY toYYYYMM(timestamp)
-            ORDER BY (device_id, sensor_type, timestamp)
-            """
-        )
+        _create_table(client, "sensor_data", SENSOR_DATA_SCHEMA, _SENSOR_DATA_COLUMNS)
+        _add_index(client, "sensor_data", "idx_location", "location TYPE set(1000) GRANULARITY 4")
+        _add_projection(client, "sensor_data", "by_time", "SELECT * ORDER BY timestamp")
         logger.info("Table 'sensor_data' created or already exists")
         
-        client.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS {config.clickhouse.database}.sensor_data_summary (
-                device_id String,
-                sensor_type String,
+        _create_table(
+            client,
+            "sensor_data_summary",
+            """
+            (
+                device_id LowCardinality(String),
+                sensor_type LowCardinality(String),
                 date Date,
                 min_value Float64,
                 max_value Float64,
@@ -54,7 +194,8 @@ def setup_database():
                 count UInt64
             ) ENGINE = SummingMergeTree()
             ORDER BY (device_id, sensor_type, date)
-            """
+            """,
+            _DIMENSION_COLUMNS
         )
         logger.info("Table 'sensor_data_summary' created or already exists")
         
@@ -77,36 +218,76 @@ def setup_database():
         )
         logger.info("Materialized view 'sensor_data_summary_mv' created or already exists")
         
-        client.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    username String,
-                    email String,
-                    full_name String,
-                    hashed_password String,
-                    role String,
-                    created_at DateTime,
-                    last_login Nullable(DateTime),
-                    is_active UInt8
-                )
-                ENGINE = MergeTree()
-                ORDER BY (username)
-                PRIMARY KEY (username)
-            """)
-            
-        client.execute("""
-            CREATE TABLE IF NOT EXISTS devices (
-                device_id String,
-                name String,
-                location String,
-                description String,
-                created_at DateTime,
-                is_active UInt8
-            )
-            ENGINE = MergeTree()
-            ORDER BY (device_id)
-            PRIMARY KEY (device_id)
-        """)
-
+        _create_table(
+            client,
+            "sensor_stats_hourly",
+            """
+            (
+                device_id LowCardinality(String),
+                sensor_type LowCardinality(String),
+                location LowCardinality(String),
+                bucket DateTime,
+                min_value AggregateFunction(min, Float64),
+                max_value AggregateFunction(max, Float64),
+                avg_value AggregateFunction(avg, Float64),
+                unit AggregateFunction(any, String)
+            ) ENGINE = AggregatingMergeTree()
+            PARTITION BY toYYYYMM(bucket)
+            ORDER BY (device_id, sensor_type, location, bucket)
+            """,
+            _DIMENSION_COLUMNS
+        )
+        logger.info("Table 'sensor_stats_hourly' created or already exists")
+        
+        _create_materialized_view(
+            client,
+            "sensor_stats_hourly_mv",
+            "sensor_stats_hourly",
+            f"""
+            SELECT
+                device_id,
+                sensor_type,
+                location,
+                toStartOfHour(timestamp) as bucket,
+                minState(value) as min_value,
+                maxState(value) as max_value,
+                avgState(value) as avg_value,
+                anyState(unit) as unit
+            FROM {config.clickhouse.database}.sensor_data
+            GROUP BY device_id, sensor_type, location, bucket
+            """
+        )
+        logger.info("Materialized view 'sensor_stats_hourly_mv' created or already exists")
+        
+        _create_table(
+            client,
+            "sensor_meta",
+            """
+            (
+                device_id LowCardinality(String),
+                sensor_type LowCardinality(String),
+                location LowCardinality(String)
+            ) ENGINE = ReplacingMergeTree()
+            ORDER BY (device_id, sensor_type, location)
+            """,
+            _DIMENSION_COLUMNS
+        )
+        logger.info("Table 'sensor_meta' created or already exists")
+        
+        _create_materialized_view(
+            client,
+            "sensor_meta_mv",
+            "sensor_meta",
+            f"""
+            SELECT DISTINCT
+                device_id,
+                sensor_type,
+                location
+            FROM {config.clickhouse.database}.sensor_data
+            """
+        )
+        logger.info("Materialized view 'sensor_meta_mv' created or already exists")
+        
         logger.info("Database setup completed successfully")
         
     except Exception as e:
@@ -1,8 +1,8 @@
-import json
 import random
 import time
 from datetime import datetime
 
+import orjson
 import paho.mqtt.client as mqtt
 
 
@@ -10,6 +10,7 @@ MQTT_BROKER_HOST = "localhost"
 MQTT_BROKER_PORT = 1883
 MQTT_CLIENT_ID = "test_publisher"
 MQTT_TOPIC_TEMPLATE = "sensors/{device_id}/data"
+PUBLISH_INTERVAL = 5.0
 
 DEVICES = [
     {"id": "device001", "type": "temperature", "unit": "°C", "location": "room1"},
@@ -19,14 +20,22 @@ DEVICES = [
 ]
 
 
+VALUE_RANGES = {
+    "temperature": (15.0, 35.0),
+    "humidity": (30.0, 90.0),
+    "pressure": (970.0, 1030.0),
+    "light": (0.0, 1000.0),
+}
+
+# Topics don't change between ticks; build them once per device.
+TOPICS = {
+    device["id"]: MQTT_TOPIC_TEMPLATE.format(device_id=device["id"])
+    for device in DEVICES
+}
+
+
 def generate_random_value(device_type):
-    ranges = {
-        "temperature": (15.0, 35.0),
-        "humidity": (30.0, 90.0),
-        "pressure": (970.0, 1030.0),
-        "light": (0.0, 1000.0),
-    }
-    min_val, max_val = ranges.get(device_type, (0.0, 100.0))
+    min_val, max_val = VALUE_RANGES.get(device_type, (0.0, 100.0))
     return round(random.uniform(min_val, max_val), 2)
 
 
@@ -36,7 +45,7 @@ def create_message(device):
         "sensor_type": device["type"],
         "value": generate_random_value(device["type"]),
         "unit": device["unit"],
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.utcnow(),
         "location": device["location"],
         "metadata": {
             "battery": random.randint(50, 100),
@@ -55,12 +64,14 @@ def on_connect(client, userdata, flags, rc):
 def publish_data(client):
     for device in DEVICES:
         message = create_message(device)
-        topic = MQTT_TOPIC_TEMPLATE.format(device_id=device["id"])
-        payload = json.dumps(message)
+        topic = TOPICS[device["id"]]
+        # orjson writes the naive datetime in isoformat and returns bytes,
+        # which paho sends as-is.
+        payload = orjson.dumps(message)
         result = client.publish(topic, payload)
         
         if result.rc == 0:
-            print(f"Published to {topic}: {payload}")
+            print(f"Published to {topic}: {payload.decode()}")
         else:
             print(f"Failed to publish to {topic}")
 
@@ -74,9 +85,18 @@ def main():
         client.loop_start()
         
         try:
+            # Ticks are scheduled against a monotonic deadline so publish
+            # time doesn't add up into drift; a late tick resets the schedule
+            # instead of firing a burst to catch up.
+            next_tick = time.monotonic()
             while True:
                 publish_data(client)
-                time.sleep(5)
+                next_tick += PUBLISH_INTERVAL
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_tick = time.monotonic()
         except KeyboardInterrupt:
             print("Stopping test publisher")
             
@@ -22,15 +22,11 @@ export default function FilterControls({ onFilterChange, showReset = true }: Fil
   useEffect(() => {
     const loadFilterOptions = async () => {
       try {
-        const [devicesData, sensorTypesData, locationsData] = await Promise.all([
-          api.getDevices(),
-          api.getSensorTypes(),
-          api.getLocations()
-        ]);
+        const metadata = await api.getAllMetadata();
         
-        setDevices(devicesData);
-        setSensorTypes(sensorTypesData);
-        setLocations(locationsData);
+        setDevices(metadata.devices);
+        setSensorTypes(metadata.sensor_types);
+        setLocations(metadata.locations);
       } catch (error) {
         console.error("Error loading filter options:", error);
       }
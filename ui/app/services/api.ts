@@ -50,6 +50,12 @@ export interface SensorStatsResponse {
   data: SensorStats[];
 }
 
+export interface MetadataResponse {
+  devices: string[];
+  sensor_types: string[];
+  locations: string[];
+}
+
 export const authApi = {
   register: async (userData: RegisterData): Promise<User> => {
     const response = await apiClient.post<User>('/auth/register', userData);
@@ -154,6 +160,11 @@ export const api = {
     return response.data;
   },
 
+  getAllMetadata: async (): Promise<MetadataResponse> => {
+    const response = await apiClient.get<MetadataResponse>('/metadata/all');
+    return response.data;
+  },
+
   getDevices: async (): Promise<string[]> => {
     const response = await apiClient.get<string[]>('/metadata/devices');
     return response.data;